@@ -2,79 +2,172 @@
 __version__ = '0.2.0'
 
 import argparse
+import concurrent.futures
+import itertools
 import json
 import logging
 import os
+import re
 import subprocess
-import mimetypes
 import sys
 from typing import *
 from pathlib import Path
 
 import inquirer
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logging.basicConfig(
     level=logging.INFO,
     format="[%(levelname)s] %(message)s\n"
 )
 
 
-def resize(seq: List, n: int, default=None) -> List:
-    """ resize seq to exactly have n members """
-    seq = seq[:n]
-    seq = seq + [default] * (n - len(seq))
-    return seq
+VIDEO_EXTENSIONS = {
+    '.mp4', '.mkv', '.avi', '.mov', '.webm', '.m4v',
+    '.mpg', '.mpeg', '.wmv', '.flv', '.ogv', '.3gp'
+}
+SUB_EXTENSIONS = {'.srt', '.ass', '.ssa', '.vtt'}
+IGNORED_NAMES = {'__pycache__', 'node_modules', 'Thumbs.db'}
+DIGITS = re.compile(r'(\d+)')
 
 
-class Video:
-    def __init__(self, index: int, video_file: str, sub_file: str):
-        self.index = index
-        self.video = video_file
-        self.sub = sub_file
-
-    def watch(self) -> int:
-        """ call watch process """
-        logging.info("Watching %s...", self.video)
-        command = ["mpv", self.video, "--no-terminal"]
-        if self.sub:
-            command.append(f"--sub-file={self.sub}")
-        try:
-            subprocess.run(command, check=True)
-        except subprocess.CalledProcessError as err:
-            logging.error("Watch process ends with %s code", err.returncode)
-        return self.index
+def is_ignored(name: str) -> bool:
+    """ check if hidden or junk entry """
+    return name.startswith('.') or name in IGNORED_NAMES
+
+
+def warn_unreadable(err: OSError) -> None:
+    """ log skipped unreadable directory """
+    logging.warning("Skipped %s: %s", err.filename, err.strerror)
+
+
+def list_directory(directory: str, depth: int,
+                   max_depth: Optional[int] = None) -> Tuple[List[str], List[Tuple[str, int]]]:
+    """ list files and subdirectories worth descending into """
+    files, subdirs = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # prune before descending into junk subtrees
+                if is_ignored(entry.name):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if max_depth is None or depth + 1 < max_depth:
+                        subdirs.append((entry.path, depth + 1))
+                else:
+                    files.append(entry.path)
+    except OSError as err:
+        # only an unreadable root is fatal, like rglob
+        if depth == 0:
+            raise
+        warn_unreadable(err)
+    return files, subdirs
+
+
+def scandir_files(root: str, max_depth: Optional[int] = None) -> Iterator[List[str]]:
+    """ walk root with an explicit stack and yield file paths per directory """
+    stack = [(root, 0)]
+    while stack:
+        files, subdirs = list_directory(*stack.pop(), max_depth)
+        if files:
+            yield files
+        # reversed, so subdirectories pop in listing order
+        stack.extend(reversed(subdirs))
+
+
+def parallel_files(root: str, max_depth: Optional[int] = None,
+                   jobs: Optional[int] = None) -> Iterator[List[str]]:
+    """ walk root with concurrent scandir calls and yield file paths per directory """
+    # scandir releases the GIL, so listings of sibling directories overlap
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+    try:
+        pending = {executor.submit(list_directory, root, 0, max_depth)}
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending,
+                return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                files, subdirs = future.result()
+                if files:
+                    yield files
+                for directory, depth in subdirs:
+                    pending.add(executor.submit(list_directory, directory, depth, max_depth))
+    finally:
+        # drop queued listings, so an interrupted walk exits promptly
+        executor.shutdown(cancel_futures=True)
+
+
+def iter_files(root: str, max_depth: Optional[int] = None, jobs: int = 1) -> Iterator[List[str]]:
+    """ walk root and yield file paths in per-directory batches """
+    if jobs > 1:
+        return parallel_files(root, max_depth, jobs)
+    return scandir_files(root, max_depth)
+
+
+def natural_key(text: str) -> Tuple[Union[int, str], ...]:
+    """ sort key comparing digit runs as numbers, so ep2 comes before ep10 """
+    parts = DIGITS.split(text)
+    # odd parts are exactly the runs matched by DIGITS
+    parts[1::2] = [int(part) for part in parts[1::2]]
+    return tuple(parts)
+
+
+def watch(video: str, sub: Optional[str]) -> int:
+    """ call watch process and return its exit code """
+    logging.info("Watching %s...", video)
+    command = ["mpv", video, "--no-terminal"]
+    if sub:
+        command.append(f"--sub-file={sub}")
+    returncode = subprocess.run(command).returncode
+    if returncode != 0:
+        logging.error("Watch process ends with %s code", returncode)
+    return returncode
+
 
+class Video:
     @staticmethod
-    def is_video(filename: str) -> bool:
-        """ check if video """
-        guess_type, _ = mimetypes.guess_type(filename)
-        return guess_type is not None and guess_type[:6] == "video/"
+    def is_video(ext: str) -> bool:
+        """ check if video, ext must be lowercase """
+        return ext in VIDEO_EXTENSIONS
 
     @staticmethod
-    def is_sub(filename: str) -> bool:
-        """ check if sub """
-        guess_type, _ = mimetypes.guess_type(filename)
-        return guess_type == "application/x-subrip"
+    def is_sub(ext: str) -> bool:
+        """ check if sub, ext must be lowercase """
+        return ext in SUB_EXTENSIONS
 
     @classmethod
-    def find_all(cls, files: List[str]) -> List['Video']:
-        """ find and match videos and subs """
-        # sort lexographically
-        videos = sorted(filter(cls.is_video, files))
-        subs = sorted(filter(cls.is_sub, files))
-        subs = resize(subs, len(videos))
-        return [Video(i, vid, sub) for i, (vid, sub) in enumerate(zip(videos, subs))]
+    def find_all(cls, batches: Iterable[List[str]]) -> Tuple[List[str], List[Optional[str]]]:
+        """ find videos and their matched subs as parallel lists """
+        # lowercase each extension once and split into videos and subs
+        videos, subs = [], []
+        for batch in batches:
+            for filename in batch:
+                ext = filename[filename.rfind('.'):].lower()
+                if cls.is_video(ext):
+                    videos.append(filename)
+                elif cls.is_sub(ext):
+                    subs.append(filename)
+        # sort naturally, keys are computed once per file
+        videos.sort(key=natural_key)
+        subs.sort(key=natural_key)
+        # drop extra subs and pad missing ones with None, in place
+        del subs[len(videos):]
+        subs.extend(itertools.repeat(None, len(videos) - len(subs)))
+        return videos, subs
 
 
 class Context:
     def __init__(self, filename: Path):
-        self.data = {}
-        self.counter = 0
+        self.data = {'counter': 0}
         self.filename = filename
         self.read_file()
-
-    def __del__(self):
-        self.write_file()
+        self.dirty = False
+        self.cache_changed = False
 
     @property
     def counter(self) -> int:
@@ -84,34 +177,110 @@ class Context:
     @counter.setter
     def counter(self, value: int):
         """ update counter """
-        self.data['counter'] = value
+        if self.data.get('counter') != value:
+            self.data['counter'] = value
+            self.dirty = True
+
+    @property
+    def cache(self) -> Optional[Dict[str, Any]]:
+        """ get cached walk settings and episode list """
+        return self.data.get('cache')
+
+    @cache.setter
+    def cache(self, value: Dict[str, Any]):
+        """ update cached walk settings and episode list """
+        self.data['cache'] = value
+        self.dirty = True
+        self.cache_changed = True
+
+    def is_fresh(self) -> bool:
+        """ check if directory is unchanged since last write """
+        try:
+            file_mtime = self.filename.stat().st_mtime_ns
+        except FileNotFoundError:
+            return False
+        return self.filename.parent.stat().st_mtime_ns == file_mtime
 
     def read_file(self):
         """ load from file """
         if not self.filename.is_file():
             return
+        if orjson is not None:
+            self.data = orjson.loads(self.filename.read_bytes())
+            return
         with self.filename.open() as file:
             self.data = json.load(file)
 
     def write_file(self) -> None:
-        """ write to file """
-        with self.filename.open(mode='w') as file:
-            json.dump(self.data, file, indent=4)
+        """ write to file if changed """
+        if not self.dirty:
+            return
+        # an old episode list stays trusted only while directory is unchanged
+        if self.cache is not None and not self.cache_changed and not self.is_fresh():
+            del self.data['cache']
+        stamp = self.cache is not None
+        # write aside and swap, so an interrupted write keeps the old file
+        temp = self.filename.with_name(self.filename.name + '.tmp')
+        if orjson is not None:
+            temp.write_bytes(orjson.dumps(self.data, option=orjson.OPT_INDENT_2))
+        else:
+            with temp.open(mode='w') as file:
+                json.dump(self.data, file, indent=4)
+        temp.replace(self.filename)
+        self.dirty = False
+        self.cache_changed = False
+        if not stamp:
+            return
+        # stamp with directory mtime, later changes to directory break the match
+        stat = self.filename.stat()
+        directory_mtime = self.filename.parent.stat().st_mtime_ns
+        os.utime(self.filename, ns=(stat.st_atime_ns, directory_mtime))
 
 
 class Workflow:
-    def __init__(self, root: Path, noconfirm: bool = False):
+    def __init__(self, root: Path, noconfirm: bool = False,
+                 max_depth: Optional[int] = None, jobs: int = 1, cache: bool = False):
         self.root = root
         self.ctx = Context(filename=self.root/'.fiml')
         self.noconfirm = noconfirm
+        self.max_depth = max_depth
+        self.jobs = jobs
+        self.cache = cache
+
+    def find_videos(self) -> Tuple[List[str], List[Optional[str]]]:
+        """ find videos and subs, reusing cache while root is unchanged """
+        root = str(self.root)
+        prefix = os.path.join(root, '')
+        settings = {'max_depth': self.max_depth}
+        cache = self.ctx.cache
+        if self.cache and cache is not None and self.ctx.is_fresh() \
+                and all(cache.get(key) == value for key, value in settings.items()):
+            videos = [os.path.join(root, vid) for vid in cache['videos']]
+            subs = [sub and os.path.join(root, sub) for sub in cache['subs']]
+            return videos, subs
+
+        # explore whole directory, filtering each batch as it arrives
+        batches = iter_files(
+            root,
+            max_depth=self.max_depth,
+            jobs=self.jobs
+        )
+
+        # find videos and match subs to them
+        videos, subs = Video.find_all(batches)
+        if self.cache:
+            # paths relative to root, so the cache still works after a move
+            self.ctx.cache = dict(
+                settings,
+                videos=[vid[len(prefix):] for vid in videos],
+                subs=[sub and sub[len(prefix):] for sub in subs]
+            )
+            self.save()
+        return videos, subs
 
     def run(self) -> bool:
         """ run the workflow """
-        # explore whole directory
-        all_files = list(map(str, self.root.rglob('*')))
-
-        # find videos and match subs to them
-        videos = Video.find_all(all_files)
+        videos, subs = self.find_videos()
 
         # if no new episode
         if self.ctx.counter >= len(videos):
@@ -119,11 +288,11 @@ class Workflow:
             self.ctx.counter = len(videos)
 
         # prompt to choose a video
-        options = [vid.video for vid in videos]
-        options.append("exit")
+        choices = [(vid, i) for i, vid in enumerate(videos)]
+        choices.append(("exit", len(videos)))
         current = self.choose_option(
             message="Which episode?",
-            options=options,
+            choices=choices,
             default=self.ctx.counter
         )
 
@@ -137,22 +306,36 @@ class Workflow:
         if self.ctx.counter != current and self.ask_confirm(reset_message):
             self.ctx.counter = current
 
-        videos[current].watch()
-
-        # default option and increament
-        complete_message = "Did you watch this episode completely?"
-        if current == self.ctx.counter and self.ask_confirm(complete_message):
-            self.ctx.counter += 1
-            return True
+        # default option, increament optimistically and save before playing
+        is_next = current == self.ctx.counter
+        if is_next:
+            self.ctx.counter = current + 1
+        self.save()
 
-        # no further watch
-        return False
+        completed = False
+        try:
+            returncode = watch(videos[current], subs[current])
+            complete_message = "Did you watch this episode completely?"
+            completed = is_next and returncode == 0 and self.ask_confirm(complete_message)
+        finally:
+            # roll back if playback failed, was interrupted or not finished
+            if is_next and not completed:
+                self.ctx.counter = current
+                self.save()
+
+        return completed
+
+    def save(self) -> None:
+        """ write context, a read-only library only gets a warning """
+        try:
+            self.ctx.write_file()
+        except OSError as err:
+            logging.warning("Could not save %s: %s", self.ctx.filename, err.strerror)
 
-    def choose_option(self, message: str, options: List[str], default: int = 0) -> int:
-        """ option prompt on terminal """
+    def choose_option(self, message: str, choices: List[Tuple[str, int]], default: int = 0) -> int:
+        """ option prompt on terminal, choices are (label, index) pairs """
         if self.noconfirm:
             return default
-        choices = [(opt, i) for i, opt in enumerate(options)]
         return inquirer.list_input(
             message=message,
             choices=choices,
@@ -169,6 +352,14 @@ class Workflow:
         )
 
 
+def positive_int(value: str) -> int:
+    """ argparse type for integers of at least one """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
 def main():
     """ command line function """
     # parse arguments
@@ -188,6 +379,24 @@ def main():
         action='store_true',
         help='play in batch'
     )
+    parser.add_argument(
+        '-d', '--max-depth',
+        default=3,
+        type=positive_int,
+        help='levels of directories to search, like find -maxdepth (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        default=1,
+        type=positive_int,
+        help='threads for walking directories, useful on network mounts (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-c', '--cache',
+        action='store_true',
+        help='reuse episode list while series directory is unchanged, '
+             'changes inside subdirectories are not noticed'
+    )
     parser.add_argument(
         '-p', '--path',
         default='./',
@@ -204,7 +413,10 @@ def main():
 
     workflow = Workflow(
         root=path,
-        noconfirm=args.noconfirm
+        noconfirm=args.noconfirm,
+        max_depth=args.max_depth,
+        jobs=args.jobs,
+        cache=args.cache
     )
     try:
         further_watch = True
@@ -15,4 +15,7 @@ setup(
         "console_scripts": ["fiml=fiml:main"]
     },
     install_requires=install_requires,
+    extras_require={
+        "fast": ["orjson"]
+    },
 )